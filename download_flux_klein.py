@@ -4,7 +4,8 @@ Download ALL models for FLUX.2 Klein 9B to Modal volume
 🌩️  THIS RUNS IN MODAL CLOUD - NOT ON YOUR LOCAL MACHINE
 📥 Downloads happen in Modal's infrastructure directly to your volume
 💾 Uses ZERO local disk space
-⚡ Uses aria2 with 16 parallel connections for FAST downloads
+⚡ Uses hf_transfer (Rust, multi-connection) for FAST downloads
+🔀 All models download concurrently in a single container
 
 Downloads:
   - flux-2-klein-9b.safetensors (~18GB) - Main diffusion model (requires HF license)
@@ -12,14 +13,28 @@ Downloads:
   - flux2-vae.safetensors (~335MB) - VAE
 
 Run: modal run download_flux_klein.py
+     modal run download_flux_klein.py --only flux-2-klein-9b.safetensors
 """
 import modal
 import os
+import json
 
 # Hardcode values
 VOLUME_NAME = "my-comfy-models"
 VOLUME_MOUNT = "/root/per_comfy-storage"
 
+# Retry policy for transient network errors; downloads resume from the
+# partial file each attempt. Stalls are only caught on the requests-based
+# path (metadata lookups and resumed attempts, where hf_transfer isn't used):
+# huggingface_hub's default 10s read timeout raises and the loop retries.
+# The first attempt goes through hf_transfer, which has no stall detection;
+# it retries chunks that fail outright but never aborts a slow stream.
+MAX_TRIES = 5
+RETRY_WAIT = 3  # seconds
+
+# {filename: {"sha256", "size", "url"}} for every verified download
+MANIFEST_NAME = ".manifest.json"
+
 # Models to download
 MODELS = {
     # FLUX.2 Klein 9B - Main model (REQUIRES HF LICENSE)
@@ -45,125 +60,268 @@ MODELS = {
     },
 }
 
-# Read HF token from .env file locally (only runs on your machine, not in Modal)
-def get_hf_token():
-    from pathlib import Path
-    env_path = Path(__file__).parent / ".env"
-    if env_path.exists():
-        with open(env_path) as f:
-            for line in f:
-                line = line.strip()
-                if line.startswith("HF_TOKEN"):
-                    return line.split("=", 1)[1].strip().strip('"').strip("'")
-    return os.getenv("HF_TOKEN")
+
+def _parse_hf_url(url: str):
+    """Split a huggingface.co resolve URL into (repo_id, revision, path)."""
+    repo_part, _, rest = url.split("huggingface.co/", 1)[1].partition("/resolve/")
+    revision, _, path = rest.partition("/")
+    return repo_part, revision, path
+
+
+# Resolve each URL once so workers get repo/file coordinates directly
+for _info in MODELS.values():
+    _info["repo_id"], _info["revision"], _info["repo_path"] = _parse_hf_url(_info["url"])
+
+
+def _drop_page_cache(path: str):
+    """Release a freshly written file from the page cache (Linux only)."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    except AttributeError:
+        pass  # posix_fadvise is unavailable on macOS/Windows
+    finally:
+        os.close(fd)
+
+
+def _sha256(path: str, chunk_size: int = 16 * 1024 * 1024) -> str:
+    """
+    Hashes a file with large unbuffered reads into one reused buffer: 16MB
+    per read() keeps syscall overhead negligible on multi-GB files, and
+    hashlib releases the GIL so concurrent downloads verify in parallel.
+    """
+    import hashlib
+    digest = hashlib.sha256()
+    buf = bytearray(chunk_size)
+    view = memoryview(buf)
+    with open(path, "rb", buffering=0) as f:
+        try:
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        except AttributeError:
+            pass  # posix_fadvise is unavailable on macOS/Windows
+        while n := f.readinto(buf):
+            digest.update(view[:n])
+    return digest.hexdigest()
 
 # Create app with volume
 image = (
     modal.Image.debian_slim(python_version="3.11")
-    .apt_install("wget", "curl", "aria2")
+    .apt_install("wget", "curl")
+    .pip_install("huggingface_hub", "hf_transfer")
+    .env({
+        "HF_HUB_ENABLE_HF_TRANSFER": "1",  # Rust multi-connection downloader
+        "HF_HOME": f"{VOLUME_MOUNT}/hf_cache",
+    })
 )
 
 app = modal.App(name="flux-klein-downloader")
 volume = modal.Volume.from_name(VOLUME_NAME, create_if_missing=True)
 
 
+def _with_retries(filename: str, info: dict, fn):
+    """
+    Calls fn() until it succeeds, up to MAX_TRIES times.
+    Returns (True, result), or (False, None) once it gives up.
+    """
+    import time
+    from huggingface_hub.utils import EntryNotFoundError, GatedRepoError, RepositoryNotFoundError
+
+    for attempt in range(1, MAX_TRIES + 1):
+        try:
+            return True, fn()
+        except (GatedRepoError, RepositoryNotFoundError, EntryNotFoundError) as e:
+            # Permission or path problems won't fix themselves on retry
+            print(f"   ❌ {filename} download failed: {e}")
+            if info["requires_auth"]:
+                print(f"   💡 Make sure you accepted the license:")
+                print(f"      https://huggingface.co/black-forest-labs/FLUX.2-klein-9B")
+            return False, None
+        except Exception as e:
+            if attempt == MAX_TRIES:
+                print(f"   ❌ {filename} download failed after {MAX_TRIES} attempts: {e}")
+                return False, None
+            print(f"   ⚠️  {filename} attempt {attempt}/{MAX_TRIES} failed: {e}")
+            time.sleep(RETRY_WAIT)
+
+
+def download_one(filename: str, info: dict, hf_token: str):
+    """Download and verify a single model from HuggingFace via hf_transfer.
+
+    Plain function so other downloader scripts can reuse it; must run where
+    the volume is mounted. The caller is responsible for volume.commit().
+    Returns the manifest entry for the file, or None on failure.
+    """
+    from huggingface_hub import get_hf_file_metadata, hf_hub_download, hf_hub_url
+
+    local_dir = f"{VOLUME_MOUNT}/{info['dir']}"
+    output_path = f"{local_dir}/{filename}"
+    token = hf_token if info["requires_auth"] else None
+
+    # LFS files report their SHA256 as the etag; anything else can't be checked
+    ok, metadata = _with_retries(filename, info, lambda: get_hf_file_metadata(
+        hf_hub_url(info["repo_id"], info["repo_path"], revision=info["revision"]),
+        token=token,
+    ))
+    if not ok:
+        return None
+    expected = metadata.etag if metadata.etag and len(metadata.etag) == 64 else None
+
+    # A file without a manifest entry may be a leftover from an interrupted
+    # run; keep it only if its hash matches
+    if os.path.exists(output_path):
+        print(f"🔍 Verifying existing {filename}...")
+        digest = _sha256(output_path)
+        if expected is None or digest == expected:
+            print(f"⏭️  Keeping {filename} (checksum OK)")
+            return {"sha256": digest, "size": os.path.getsize(output_path), "url": info["url"]}
+        print(f"   ⚠️  Checksum mismatch, re-downloading {filename}")
+        os.remove(output_path)
+
+    print(f"📥 Downloading: {filename}")
+    print(f"   Size: {info['size']}")
+    print(f"   Destination: {output_path}")
+
+    os.makedirs(local_dir, exist_ok=True)
+
+    # Repo layout is preserved under local_dir, so stage on the volume
+    # and rename into the flat model directory ComfyUI expects
+    ok, downloaded = _with_retries(filename, info, lambda: hf_hub_download(
+        repo_id=info["repo_id"],
+        filename=info["repo_path"],
+        revision=info["revision"],
+        local_dir=f"{VOLUME_MOUNT}/.hf_downloads/{info['repo_id']}",
+        token=token,
+    ))
+    if not ok:
+        return None
+
+    digest = _sha256(downloaded)
+    if expected is not None and digest != expected:
+        print(f"   ❌ {filename} checksum mismatch (expected {expected}, got {digest})")
+        os.remove(downloaded)
+        return None
+
+    os.replace(downloaded, output_path)
+    # The weights are read once at model load; don't let them crowd out
+    # the page cache for the other downloads
+    _drop_page_cache(output_path)
+
+    print(f"   ✅ {filename} downloaded successfully!")
+    return {"sha256": digest, "size": os.path.getsize(output_path), "url": info["url"]}
+
+
 @app.function(
     image=image,
     volumes={VOLUME_MOUNT: volume},
     timeout=7200  # 2 hours for large downloads
 )
-def download_all_models(hf_token: str):
-    """Download all FLUX.2 Klein 9B models with aria2 parallel downloads"""
-    import subprocess
-    
-    print("=" * 70)
-    print("🚀 FLUX.2 KLEIN 9B - COMPLETE MODEL DOWNLOAD")
-    print("=" * 70)
-    print()
-    print("📦 Models to download:")
-    for name, info in MODELS.items():
-        auth = "🔐 (requires HF token)" if info["requires_auth"] else "🌐 (public)"
-        print(f"   • {name} ({info['size']}) {auth}")
-    print()
-    print("=" * 70)
-    
+def download_all_models(models: dict, hf_token: str):
+    """
+    Downloads all given models concurrently in this container.
+
+    Small files finish while the large one is still ramping up, without the
+    cold-start cost of a container per model. Returns the failed filenames.
+    """
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    manifest_path = f"{VOLUME_MOUNT}/{MANIFEST_NAME}"
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
     failed = []
-    
-    for filename, info in MODELS.items():
-        local_dir = f"{VOLUME_MOUNT}/{info['dir']}"
-        output_path = f"{local_dir}/{filename}"
-        
-        # Skip if already exists
-        if os.path.exists(output_path):
-            size_gb = os.path.getsize(output_path) / (1024**3)
-            print(f"⏭️  Skipping {filename} (already exists, {size_gb:.2f} GB)")
-            continue
-        
-        print()
-        print(f"📥 Downloading: {filename}")
-        print(f"   Size: {info['size']}")
-        print(f"   Destination: {output_path}")
-        
-        os.makedirs(local_dir, exist_ok=True)
-        
-        # Build aria2c command
-        cmd = [
-            "aria2c",
-            "-x", "16",
-            "-s", "16",
-            "-k", "1M",
-            "-c",
-            "--file-allocation=none",
-            "-d", local_dir,
-            "-o", filename,
-        ]
-        
-        # Add auth header if required
-        if info["requires_auth"]:
-            cmd.append(f"--header=Authorization: Bearer {hf_token}")
-        
-        cmd.append(info["url"])
-        
-        result = subprocess.run(cmd, capture_output=False)
-        
-        if result.returncode == 0:
-            print(f"   ✅ {filename} downloaded successfully!")
-        else:
-            print(f"   ❌ {filename} download failed!")
-            if info["requires_auth"]:
-                print(f"   💡 Make sure you accepted the license:")
-                print(f"      https://huggingface.co/black-forest-labs/FLUX.2-klein-9B")
-            failed.append(filename)
-    
-    # Commit volume
+    with ThreadPoolExecutor(max_workers=len(models)) as executor:
+        futures = {
+            executor.submit(download_one, filename, info, hf_token): filename
+            for filename, info in models.items()
+        }
+        for future in as_completed(futures):
+            filename = futures[future]
+            try:
+                entry = future.result()
+            except Exception as e:
+                # e.g. an OSError while hashing or moving the file; don't let
+                # one file keep the others out of the manifest
+                print(f"   ❌ {filename} failed: {e}")
+                entry = None
+            if entry is None:
+                failed.append(filename)
+            else:
+                manifest[filename] = entry
+
+    # Write the manifest atomically, then commit volume once
+    with open(f"{manifest_path}.tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(f"{manifest_path}.tmp", manifest_path)
     volume.commit()
-    
-    print()
-    print("=" * 70)
-    if failed:
-        print(f"⚠️  COMPLETED WITH ERRORS")
-        print(f"   Failed: {', '.join(failed)}")
-    else:
-        print("✅ ALL MODELS DOWNLOADED SUCCESSFULLY!")
-    print()
-    print("📂 Models saved to Modal volume:")
-    print(f"   • {VOLUME_MOUNT}/diffusion_models/flux-2-klein-9b.safetensors")
-    print(f"   • {VOLUME_MOUNT}/text_encoders/qwen_3_8b_fp8mixed.safetensors")
-    print(f"   • {VOLUME_MOUNT}/vae/flux2-vae.safetensors")
-    print("=" * 70)
-    
-    if failed:
-        raise Exception(f"Failed to download: {', '.join(failed)}")
+    return failed
+
+
+def read_manifest() -> dict:
+    """Fetches the download manifest from the volume, or {} if none exists."""
+    try:
+        return json.loads(b"".join(volume.read_file(MANIFEST_NAME)))
+    except (FileNotFoundError, modal.exception.NotFoundError):
+        return {}
+
+
+def scan_existing(models: dict) -> dict:
+    """
+    Lists each model directory on the volume once and returns
+    {filename: size_bytes} for files already present.
+
+    A file left next to an aria2c ".aria2" control file is a partial download
+    from the old downloader; it is removed so it gets fetched again.
+    """
+    existing = {}
+    for model_dir in {info["dir"] for info in models.values()}:
+        try:
+            entries = volume.listdir(f"/{model_dir}")
+        except (FileNotFoundError, modal.exception.NotFoundError):
+            continue
+        sizes = {os.path.basename(entry.path): entry.size for entry in entries}
+        for name, size in sizes.items():
+            if name.endswith(".aria2"):
+                continue
+            if f"{name}.aria2" in sizes:
+                print(f"🧹 Removing partial download: {model_dir}/{name}")
+                volume.remove_file(f"/{model_dir}/{name}")
+                volume.remove_file(f"/{model_dir}/{name}.aria2")
+                continue
+            existing[name] = size
+    return existing
 
 
 @app.local_entrypoint()
-def main():
+def main(only: str = "all"):
+    """
+    Args:
+        only: "all", or a comma-separated list of MODELS filenames to fetch
+    """
     print()
     print("🚀 FLUX.2 Klein 9B - Complete Model Download")
     print("=" * 50)
-    
+
+    if only == "all":
+        selected = dict(MODELS)
+    else:
+        names = [name.strip() for name in only.split(",") if name.strip()]
+        unknown = [name for name in names if name not in MODELS]
+        if unknown:
+            print(f"❌ Unknown model(s): {', '.join(unknown)}")
+            print(f"   Available: {', '.join(MODELS)}")
+            return
+        selected = {name: MODELS[name] for name in names}
+
+    # Local-only import: loaders/python-dotenv aren't shipped to the container
+    from loaders import get_hf_token
+
     hf_token = get_hf_token()
-    if not hf_token:
+    if not hf_token and any(info["requires_auth"] for info in selected.values()):
         print("❌ HF_TOKEN not found!")
         print("   Add it to your .env file: HF_TOKEN=hf_xxx...")
         print()
@@ -171,12 +329,48 @@ def main():
         print("💡 Accept FLUX license: https://huggingface.co/black-forest-labs/FLUX.2-klein-9B")
         return
     
-    print("✅ HF Token found")
-    print("📦 Building image and starting download...")
+    print("✅ HF Token found" if hf_token else "🌐 Public models only, no HF token needed")
     print()
-    
-    download_all_models.remote(hf_token)
-    
+    print("📦 Models to download:")
+    for name, info in selected.items():
+        auth = "🔐 (requires HF token)" if info["requires_auth"] else "🌐 (public)"
+        print(f"   • {name} ({info['size']}) {auth}")
+    print()
+
+    # One listing per model directory instead of a stat per file. Only files
+    # the manifest vouches for are skipped; others get verified remotely.
+    existing = scan_existing(selected)
+    manifest = read_manifest()
+    verified = {
+        name for name, size in existing.items()
+        if manifest.get(name, {}).get("size") == size
+    }
+    for name in selected:
+        if name in verified:
+            size_gb = existing[name] / (1024**3)
+            print(f"⏭️  Skipping {name} (verified, {size_gb:.2f} GB)")
+
+    print("📦 Building image and starting parallel downloads...")
+    print()
+
+    # Concurrent downloads: total time is the largest file, not the sum
+    pending = {name: info for name, info in selected.items() if name not in verified}
+    failed = download_all_models.remote(pending, hf_token) if pending else []
+
+    print()
+    print("=" * 70)
+    if failed:
+        print(f"⚠️  COMPLETED WITH ERRORS")
+        print(f"   Failed: {', '.join(failed)}")
+        print("=" * 70)
+        raise Exception(f"Failed to download: {', '.join(failed)}")
+
+    print("✅ ALL MODELS DOWNLOADED SUCCESSFULLY!")
+    print()
+    print("📂 Models saved to Modal volume:")
+    for name, info in selected.items():
+        print(f"   • {VOLUME_MOUNT}/{info['dir']}/{name}")
+    print("=" * 70)
     print()
     print("✨ Done! All models saved to Modal volume.")
     print("   Run 'modal serve main.py' to start ComfyUI!")
@@ -12,6 +12,29 @@ from pathlib import Path
 from typing import Dict, Any, List, Optional
 import sys
 
+# Prefer the LibYAML C bindings when PyYAML was built with them
+try:
+    from yaml import CSafeDumper as SafeDumper, CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeDumper, SafeLoader
+
+
+class PathList(list):
+    """A list of paths, emitted as one YAML literal block (ComfyUI splits it on newlines)."""
+
+
+class PathsDumper(SafeDumper):
+    """Safe dumper that writes PathList values as literal block scalars."""
+
+
+def _represent_path_list(dumper: PathsDumper, paths: PathList):
+    if len(paths) <= 1:
+        return dumper.represent_str("".join(paths))
+    return dumper.represent_scalar("tag:yaml.org,2002:str", "\n".join(paths), style="|")
+
+
+PathsDumper.add_representer(PathList, _represent_path_list)
+
 
 class ModelPathsGenerator:
     """Generate extra_model_paths.yaml from config.ini"""
@@ -85,14 +108,14 @@ class ModelPathsGenerator:
             print(f"✗ Error: Missing option in [FILESYSTEM] section - {e}")
             return None
 
-    def get_model_paths(self) -> Dict[str, str]:
+    def get_model_paths(self) -> Dict[str, List[str]]:
         """
         Extract model paths from [MODEL_PATHS] section.
 
         Returns:
-            Dictionary with model paths
+            Dictionary mapping each model type to its list of paths
         """
-        model_paths_dict: Dict[str, str] = {}
+        model_paths_dict: Dict[str, List[str]] = {}
 
         if not self.config.has_section("MODEL_PATHS"):
             print("⚠ Warning: [MODEL_PATHS] section not found in config.ini")
@@ -102,9 +125,7 @@ class ModelPathsGenerator:
         try:
             for key in self.config.options("MODEL_PATHS"):
                 value = self.config.get("MODEL_PATHS", key)
-                paths = self.parse_multiline_config(value)
-                # Join paths with newline for YAML literal block style
-                model_paths_dict[key] = "\n".join(paths)
+                model_paths_dict[key] = self.parse_multiline_config(value)
 
             print(f"✓ Loaded {len(model_paths_dict)} model path configurations")
             return model_paths_dict
@@ -112,12 +133,12 @@ class ModelPathsGenerator:
             print(f"✗ Error reading model paths: {e}")
             return self._get_default_model_paths()
 
-    def _get_default_model_paths(self) -> Dict[str, str]:
+    def _get_default_model_paths(self) -> Dict[str, List[str]]:
         """
         Get default model paths if [MODEL_PATHS] section is missing.
 
         Returns:
-            Dictionary with default model paths
+            Dictionary mapping each model type to its list of paths
         """
         fs_config = self.get_filesystem_config()
         if not fs_config:
@@ -127,21 +148,21 @@ class ModelPathsGenerator:
         volume = fs_config["volume_mount_location"]
 
         return {
-            "checkpoints": f"{comfyui}/models/checkpoints\n{volume}/checkpoints",
-            "clip": f"{comfyui}/models/clip\n{volume}/text_encoders",
-            "clip_vision": f"{comfyui}/models/clip_vision",
-            "configs": f"{comfyui}/models/configs",
-            "controlnet": f"{comfyui}/models/controlnet",
-            "diffusion_models": f"{comfyui}/models/diffusion_models\n{volume}/diffusion_models",
-            "embeddings": f"{comfyui}/models/embeddings",
-            "gligen": f"{comfyui}/models/gligen",
-            "hypernetworks": f"{comfyui}/models/hypernetworks",
-            "inpaint": f"{comfyui}/models/inpaint",
-            "loras": f"{comfyui}/models/loras\n{volume}/loras",
-            "sampling": f"{comfyui}/models/sampling",
-            "upscale_models": f"{comfyui}/models/upscale_models",
-            "vae": f"{comfyui}/models/vae\n{volume}/vae",
-            "vae_approx": f"{comfyui}/models/vae_approx",
+            "checkpoints": [f"{comfyui}/models/checkpoints", f"{volume}/checkpoints"],
+            "clip": [f"{comfyui}/models/clip", f"{volume}/text_encoders"],
+            "clip_vision": [f"{comfyui}/models/clip_vision"],
+            "configs": [f"{comfyui}/models/configs"],
+            "controlnet": [f"{comfyui}/models/controlnet"],
+            "diffusion_models": [f"{comfyui}/models/diffusion_models", f"{volume}/diffusion_models"],
+            "embeddings": [f"{comfyui}/models/embeddings"],
+            "gligen": [f"{comfyui}/models/gligen"],
+            "hypernetworks": [f"{comfyui}/models/hypernetworks"],
+            "inpaint": [f"{comfyui}/models/inpaint"],
+            "loras": [f"{comfyui}/models/loras", f"{volume}/loras"],
+            "sampling": [f"{comfyui}/models/sampling"],
+            "upscale_models": [f"{comfyui}/models/upscale_models"],
+            "vae": [f"{comfyui}/models/vae", f"{volume}/vae"],
+            "vae_approx": [f"{comfyui}/models/vae_approx"],
         }
 
     def generate(self) -> bool:
@@ -172,7 +193,9 @@ class ModelPathsGenerator:
             }
 
             # Add model paths to comfyui section
-            extra_model_paths["comfyui"].update(model_paths)
+            extra_model_paths["comfyui"].update(
+                (key, PathList(paths)) for key, paths in model_paths.items()
+            )
 
             # Add custom nodes path
             custom_nodes_path = f"{fs_config['volume_mount_location']}/{fs_config['custom_nodes_dir_name']}"
@@ -183,6 +206,7 @@ class ModelPathsGenerator:
                 yaml.dump(
                     extra_model_paths,
                     yaml_file,
+                    Dumper=PathsDumper,
                     default_flow_style=False,
                     sort_keys=False,
                     allow_unicode=True,
@@ -197,7 +221,7 @@ class ModelPathsGenerator:
             print(f"✗ Error generating YAML file: {e}")
             return False
 
-    def _print_summary(self, fs_config: Dict[str, str], model_paths: Dict[str, str]):
+    def _print_summary(self, fs_config: Dict[str, str], model_paths: Dict[str, List[str]]):
         """
         Print a summary of the generated configuration.
 
@@ -217,7 +241,7 @@ class ModelPathsGenerator:
 
         print(f"\n🤖 Model Paths Configured: {len(model_paths)}")
         for key in sorted(model_paths.keys()):
-            path_count = len(model_paths[key].split('\n'))
+            path_count = len(model_paths[key])
             print(f"  ✓ {key}: {path_count} path(s)")
 
         print(f"\n📝 Output File: {self.output_file.resolve()}")
@@ -235,7 +259,7 @@ class ModelPathsGenerator:
 
         try:
             with open(self.output_file, 'r') as f:
-                data = yaml.safe_load(f)
+                data = yaml.load(f, Loader=SafeLoader)
 
             if not isinstance(data, dict):
                 print("✗ Invalid YAML structure!")
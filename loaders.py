@@ -1,8 +1,12 @@
 import os
 import configparser
+from functools import lru_cache
 from pathlib import Path
 from dotenv import load_dotenv
 
+# Project root; config and .env paths are resolved relative to this
+BASE_DIR = Path(__file__).parent.resolve()
+
 
 class ConfigLoader:
     """
@@ -12,9 +16,8 @@ class ConfigLoader:
 
     def __init__(self, config_path: str = "config.ini", env_path: str = ".env"):
         # Use absolute path relative to the script location
-        base_dir = Path(__file__).parent.resolve()
-        self.config_path = base_dir / config_path
-        self.env_path = base_dir / env_path
+        self.config_path = BASE_DIR / config_path
+        self.env_path = BASE_DIR / env_path
 
         # Initialize parser
         self.config = configparser.ConfigParser()
@@ -25,12 +28,11 @@ class ConfigLoader:
         if not self.config_path.exists():
             raise FileNotFoundError(
                 f"Configuration file not found: {self.config_path}")
-        if not self.env_path.exists():
-            raise FileNotFoundError(f".env file not found: {self.env_path}")
 
         self.config.read(self.config_path)
 
-        # Load .env file if it exists to resolve secret keys
+        # Load .env file if it exists to resolve secret keys.
+        # It's optional: secrets may already be set in the environment.
         if self.env_path.exists():
             load_dotenv(self.env_path)
 
@@ -74,13 +76,12 @@ class ConfigLoader:
         }
 
         # 2. Web Settings (Type-casted)
-        # # Extract the raw host value first
+        # Extract the raw host value first
         raw_host = self.config.get("WEB", "host", fallback="0.0.0.0").strip().lower()
         web = {
             "port": self.config.getint("WEB", "port", fallback=8000),
             # If host is 'localhost', override to '0.0.0.0' for external accessibility
             "host": "0.0.0.0" if raw_host == "localhost" else raw_host,
-            "host": self.config.get("WEB", "host"),
             "remote": self.config.getboolean("WEB", "remote", fallback=True)
         }
 
@@ -102,9 +103,12 @@ class ConfigLoader:
             "cpu": self.config.get("RESOURCES", "cpu", fallback=None),
             "memory": self.config.get("RESOURCES", "memory", fallback=None),
             "max_containers": self.config.getint("RESOURCES", "max_containers", fallback=1),
+            "min_containers": self.config.getint("RESOURCES", "min_containers", fallback=0),
+            "buffer_containers": self.config.getint("RESOURCES", "buffer_containers", fallback=0),
             "scaledown_window": self.config.getint("RESOURCES", "scaledown_window", fallback=30),
             "timeout": self.config.getint("RESOURCES", "timeout", fallback=3200),
-            "max_inputs": self.config.getint("RESOURCES", "max_inputs", fallback=10)
+            "max_inputs": self.config.getint("RESOURCES", "max_inputs", fallback=10),
+            "memory_snapshot": self.config.getboolean("RESOURCES", "memory_snapshot", fallback=False)
             # Additional resource settings can be added here
         }
 
@@ -116,6 +120,24 @@ class ConfigLoader:
         }
 
 
+@lru_cache(maxsize=1)
+def load_all(config_path: str = "config.ini", env_path: str = ".env") -> dict:
+    """
+    Loads and processes the configuration once per process.
+    The returned dictionary is shared between callers; treat it as read-only.
+    """
+    return ConfigLoader(config_path=config_path, env_path=env_path).load_configs()
+
+
+def get_hf_token(env_path: str = ".env"):
+    """
+    Loads the project .env file into the environment (existing variables
+    win) and returns HF_TOKEN. Used by the standalone downloader scripts.
+    """
+    load_dotenv(BASE_DIR / env_path)
+    return os.getenv("HF_TOKEN")
+
+
 # --- Usage Example ---
 if __name__ == "__main__":
     try:
@@ -1,7 +1,12 @@
+import json
+import os
+import shutil
 import subprocess
+import sys
 from pathlib import Path
 import modal
-from loaders import ConfigLoader
+from loaders import load_all
+from node_deps import find_node_requirements, install_custom_node_deps, install_node_requirements
 
 # ===========================
 # Global Configuration
@@ -14,9 +19,10 @@ APP_NAME = "comfyui-app"
 CURRENT_DIR = Path(__file__).parent.resolve()
 
 # Load configurations from config.ini
-cfg = ConfigLoader(config_path="config.ini", env_path=".env").load_configs()
-HF_TOKEN = str(cfg["tokens"]["hf_token"])
-CIVITAI_API_TOKEN = str(cfg["tokens"]["civitai_api_token"])
+cfg = load_all(config_path="config.ini", env_path=".env")
+# Tokens stay None when unset (no .env and nothing exported)
+HF_TOKEN = cfg["tokens"]["hf_token"]
+CIVITAI_API_TOKEN = cfg["tokens"]["civitai_api_token"]
 WEB_SERVER_HOST = str(cfg["web"]["host"])
 WEB_SERVER_PORT = cfg["web"]["port"]
 VOLUME_NAME = str(cfg["filesystem"]["volume_name"])
@@ -28,9 +34,12 @@ GPU_TYPE = str(cfg["resources"]["gpu_type"]) or None
 CPU = cfg["resources"]["cpu"]
 MEMORY = cfg["resources"]["memory"]
 MAX_CONTAINERS = cfg["resources"]["max_containers"]
+MIN_CONTAINERS = cfg["resources"]["min_containers"]
+BUFFER_CONTAINERS = cfg["resources"]["buffer_containers"]
 SCALEDOWN_WINDOW = cfg["resources"]["scaledown_window"]
 TIMEOUT = cfg["resources"]["timeout"]
 MAX_INPUTS = cfg["resources"]["max_inputs"]
+MEMORY_SNAPSHOT = cfg["resources"]["memory_snapshot"]
 
 def debug_print_config_and_exit():
     """Utility function to print configuration and exit."""
@@ -51,9 +60,12 @@ def debug_print_config_and_exit():
     print(f"CPU: {CPU}")
     print(f"MEMORY: {MEMORY}")
     print(f"MAX_CONTAINERS: {MAX_CONTAINERS}")
+    print(f"MIN_CONTAINERS: {MIN_CONTAINERS}")
+    print(f"BUFFER_CONTAINERS: {BUFFER_CONTAINERS}")
     print(f"SCALEDOWN_WINDOW: {SCALEDOWN_WINDOW}")
     print(f"TIMEOUT: {TIMEOUT}")
     print(f"MAX_INPUTS: {MAX_INPUTS}")
+    print(f"MEMORY_SNAPSHOT: {MEMORY_SNAPSHOT}")
     exit(1)
 
 # debug_print_config_and_exit()
@@ -62,47 +74,169 @@ def debug_print_config_and_exit():
 # Modal Image Configuration
 # ===========================
 
+# Mature utility nodes that rarely change
+STABLE_CUSTOM_NODES = (
+    "ComfyUI-Crystools",            # Resource monitor
+    "comfyui-easy-use",
+    "comfyui-kjnodes",
+    "comfyui_ultimatesdupscale",
+    "comfyui_essentials",
+    "comfyui-detail-daemon",
+    "seedvarianceenhancer",
+    "comfyui_controlnet_aux",
+    "ComfyUI-GGUF",                 # GGUF model support for Klein
+    "ComfyUI-KJNodes",              # Additional utilities
+    "rgthree-comfy",                # UI nodes (Image Comparer, Labels, etc.)
+    "comfyui-image-compare",        # ImageCompareNode for inpainting workflow
+)
+
+# FLUX.2 Klein + LanPaint inpainting stack, updated frequently upstream
+VOLATILE_CUSTOM_NODES = (
+    "ComfyUI-LanPaint",             # LanPaint inpainting (TMLR peer-reviewed)
+    "ComfyUI-BRIA_AI-RMBG",         # RMBG 2.0 background removal
+    "ComfyUI-segment-anything-2",   # SAM2 segmentation
+    "ComfyUI-Florence2",            # Florence2 for auto-captioning
+)
+
+# Manifest baked into the image of the custom node requirements installed at
+# build time ({node: requirements.txt mtime_ns}); anything that differs at
+# container start still needs pip
+DEPS_MANIFEST = "/root/.deps_manifest.json"
+
+# Create a persistent volume
+model_volume = modal.Volume.from_name(VOLUME_NAME, create_if_missing=True)
+
+
+# Upper bound on files fetched in parallel by one snapshot download, and the
+# count used when the repo can't be listed up front
+MAX_DOWNLOAD_WORKERS = 16
+DEFAULT_DOWNLOAD_WORKERS = 8
+
+
+def download_hf_model(repo_id: str, local_dir: str = None, patterns: list = None):
+    """
+    Downloads a HuggingFace repo (or matching files) into local_dir.
+    Without local_dir, files stay in the shared HF cache on the volume, where
+    identical blobs are stored once across models and revisions.
+    Returns the local path, or None on failure.
+    """
+    from huggingface_hub import HfApi, hf_hub_download, snapshot_download
+    from huggingface_hub.utils import filter_repo_objects
+    
+    print(f"📥 Downloading {repo_id} to {local_dir or 'the HF cache'}...")
+    
+    download_kwargs = {
+        "repo_id": repo_id,
+        "token": HF_TOKEN,
+    }
+    if local_dir:
+        download_kwargs["local_dir"] = local_dir
+    
+    try:
+        # A single exact filename skips snapshot_download's repo listing
+        if patterns and len(patterns) == 1 and not any(c in patterns[0] for c in "*?["):
+            path = hf_hub_download(filename=patterns[0], **download_kwargs)
+        else:
+            if patterns:
+                download_kwargs["allow_patterns"] = patterns
+            # hf_transfer (enabled in the image) parallelizes within each
+            # file; give every matching shard its own worker so all of them
+            # stream at once. The listing is only a sizing hint, so a failure
+            # here falls back to the default worker count.
+            try:
+                files = list(filter_repo_objects(
+                    HfApi().list_repo_files(repo_id, token=HF_TOKEN),
+                    allow_patterns=patterns,
+                ))
+                workers = max(1, min(len(files), MAX_DOWNLOAD_WORKERS))
+            except Exception as e:
+                print(f"⚠️  Could not list {repo_id} ({e}), using {DEFAULT_DOWNLOAD_WORKERS} workers")
+                workers = DEFAULT_DOWNLOAD_WORKERS
+            path = snapshot_download(max_workers=workers, **download_kwargs)
+        print(f"✅ Successfully downloaded {repo_id} to {path}")
+        return path
+    except Exception as e:
+        print(f"❌ Error downloading {repo_id}: {e}")
+        return None
+
+
+def fast_copy(src: Path, dst: Path):
+    """
+    Copies a file in-kernel with copy_file_range (no userspace buffers),
+    falling back to shutil.copy2 where that isn't supported (e.g. across
+    filesystems on older kernels). Metadata is preserved either way, as
+    with copy2.
+    """
+    try:
+        with open(src, "rb") as s, open(dst, "wb") as d:
+            remaining = os.fstat(s.fileno()).st_size
+            while remaining > 0:
+                copied = os.copy_file_range(s.fileno(), d.fileno(), remaining)
+                if copied == 0:
+                    break
+                remaining -= copied
+        if remaining == 0:
+            shutil.copystat(src, dst)
+            return
+    except (AttributeError, OSError):
+        pass
+    shutil.copy2(src, dst)
+
+
 # Define the Modal image
 comfy_image = (
     modal.Image.debian_slim(python_version="3.11")
-    .env({"HF_TOKEN": HF_TOKEN, "CIVITAI_API_TOKEN": CIVITAI_API_TOKEN})
+    # Only export tokens that are set: HF_TOKEN="None" would be sent as
+    # "Bearer None" and get a 401 even on public repos
+    .env({
+        key: value
+        for key, value in {"HF_TOKEN": HF_TOKEN, "CIVITAI_API_TOKEN": CIVITAI_API_TOKEN}.items()
+        if value
+    })
+    # Keep the HuggingFace cache on the volume so custom nodes that call
+    # from_pretrained (Florence2, SAM2, RMBG) don't re-download on cold start
+    .env({
+        "HF_HOME": f"{VOLUME_MOUNT_LOCATION}/hf_cache",
+        "HF_HUB_CACHE": f"{VOLUME_MOUNT_LOCATION}/hf_cache/hub",
+        "HF_HUB_ENABLE_HF_TRANSFER": "1",
+        # Xet chunk cache: chunks shared between repos (e.g. VAE/text encoder
+        # weights reused across FLUX variants) are fetched only once
+        "HF_XET_CACHE": f"{VOLUME_MOUNT_LOCATION}/hf_cache/xet",
+    })
     .apt_install(
         "git", "nano",
         "libgl1", "libglib2.0-0", "libsm6", "libxext6", "libxrender1"  # OpenCV dependencies
     )
     .pip_install(
-        "comfy-cli", "gguf", "sentencepiece", "opencv-python-headless",
+        "comfy-cli", "uv", "gguf", "sentencepiece", "opencv-python-headless",
         "transformers", "accelerate", "safetensors",  # For FLUX models
         "timm", "einops",  # For SAM2/Florence2
-        "huggingface-hub",  # For model downloads
+        "huggingface-hub", "hf_transfer", "hf_xet",  # For model downloads
     )
     .run_commands("comfy --skip-prompt install --nvidia")
-    .run_commands(
-        # Core Custom Nodes
-        "comfy node install ComfyUI-Crystools",  # Resource monitor
-        "comfy node install comfyui-easy-use",
-        "comfy node install comfyui-kjnodes",
-        "comfy node install comfyui_ultimatesdupscale",
-        "comfy node install comfyui_essentials",
-        "comfy node install comfyui-detail-daemon",
-        "comfy node install seedvarianceenhancer",
-        "comfy node install comfyui_controlnet_aux",
-    )
-    .run_commands(
-        # FLUX.2 Klein + LanPaint Inpainting Stack
-        "comfy node install ComfyUI-GGUF",              # GGUF model support for Klein
-        "comfy node install ComfyUI-LanPaint",          # LanPaint inpainting (TMLR peer-reviewed)
-        "comfy node install ComfyUI-BRIA_AI-RMBG",      # RMBG 2.0 background removal
-        "comfy node install ComfyUI-segment-anything-2", # SAM2 segmentation
-        "comfy node install ComfyUI-Florence2",         # Florence2 for auto-captioning
-        "comfy node install ComfyUI-KJNodes",           # Additional utilities
-        "comfy node install rgthree-comfy",             # UI nodes (Image Comparer, Labels, etc.)
-        "comfy node install comfyui-image-compare",     # ImageCompareNode for inpainting workflow
+    # Custom nodes are split by how often they change: a bump to a volatile
+    # node only rebuilds the last layer instead of re-cloning everything.
+    # Pin a node with "<name>@<version>" to keep its layer cache stable.
+    # Each group is one comfy-cli invocation, so the CLI and node registry
+    # index are loaded once per layer rather than once per node.
+    .run_commands(f"comfy node install {' '.join(STABLE_CUSTOM_NODES)}")
+    .run_commands(f"comfy node install {' '.join(VOLATILE_CUSTOM_NODES)}")
+    # Bake ComfyUI and custom node bytecode into the image so the first import
+    # on a cold start doesn't compile thousands of modules. Default
+    # optimization level: -O2 .pyc files are only used under python -OO.
+    # A node with a file that fails to compile must not break the build.
+    .run_commands(f"python -m compileall -q -j 0 {COMFYUI_DIR} || true")
+    # The build step only needs node_deps and the two paths below, so edits
+    # to config.ini don't invalidate this layer and re-run the install
+    .add_local_python_source("node_deps", copy=True)
+    .run_function(
+        install_custom_node_deps,
+        kwargs={"nodes_dir": CUSTOM_NODES_DIR, "manifest_path": DEPS_MANIFEST},
+        volumes={VOLUME_MOUNT_LOCATION: model_volume},
     )
     # Add loaders.py file for configuration loading inside the container
-    .add_local_python_source("loaders", copy=False)
+    .add_local_python_source("loaders")
     .add_local_file(str(CURRENT_DIR / "config.ini"), remote_path="/root/config.ini")
-    .add_local_file(str(CURRENT_DIR / ".env"), remote_path="/root/.env")
     # Persistent comfyui settings and workflows
     # v0.3.76+ (with System User API) # https://github.com/Comfy-Org/ComfyUI-Manager#paths
     .add_local_file(str(CURRENT_DIR / "extra_model_paths.yaml"), remote_path=str(COMFYUI_DIR + "/extra_model_paths.yaml"))
@@ -112,15 +246,16 @@ comfy_image = (
     .add_local_dir(str(CURRENT_DIR / "workflows/"), remote_path="/tmp/workflows_template/")
 )
 
+# .env is optional; without it, tokens come from the local shell environment
+if (CURRENT_DIR / ".env").exists():
+    comfy_image = comfy_image.add_local_file(str(CURRENT_DIR / ".env"), remote_path="/root/.env")
+
 # ===========================
 # Modal App Configuration
 # ===========================
 
 app = modal.App(name=APP_NAME, image=comfy_image)
 
-# Create a persistent volume
-model_volume = modal.Volume.from_name(VOLUME_NAME, create_if_missing=True)
-
 # Prepare the container arguments dynamically
 container_kwargs = {
     "max_containers": MAX_CONTAINERS,
@@ -128,6 +263,10 @@ container_kwargs = {
     "timeout": TIMEOUT,
     "gpu": GPU_TYPE,
     "volumes": {VOLUME_MOUNT_LOCATION: model_volume},
+    # Restore the Python process from a memory snapshot instead of a fresh
+    # interpreter. setup_dependencies still runs after every restore, since
+    # it depends on the volume's current custom nodes and workflows.
+    "enable_memory_snapshot": MEMORY_SNAPSHOT,
 }
 
 # Only add CPU and Memory if they actually have values
@@ -137,6 +276,13 @@ if CPU is not None:
 if MEMORY is not None:
     container_kwargs["memory"] = MEMORY
 
+# Warm pool: only set when configured, since idle containers cost money
+if MIN_CONTAINERS:
+    container_kwargs["min_containers"] = MIN_CONTAINERS
+
+if BUFFER_CONTAINERS:
+    container_kwargs["buffer_containers"] = BUFFER_CONTAINERS
+
 # User data directory on writable volume (used by --user-directory flag)
 USER_DATA_DIR = str(Path(VOLUME_MOUNT_LOCATION) / "user_data")
 
@@ -150,8 +296,6 @@ class ComfyUIContainer:
         Sets up writable user data directory on volume and installs custom node dependencies.
         Uses ComfyUI's --user-directory flag instead of symlinks for reliability.
         """
-        import shutil
-        
         # === Setup writable user data directory on volume ===
         # ComfyUI will be launched with --user-directory pointing here
         # This avoids symlink issues with Modal's read-only filesystem
@@ -162,25 +306,27 @@ class ComfyUIContainer:
         workflows_volume = user_default / "workflows"
         workflows_template = Path("/tmp/workflows_template")
         
-        # Create user_data directory structure on volume
-        user_data_volume.mkdir(parents=True, exist_ok=True)
-        user_default.mkdir(parents=True, exist_ok=True)
+        # Create user_data directory structure on volume (the deepest
+        # directory creates its parents; a no-op on warm restarts)
         workflows_volume.mkdir(parents=True, exist_ok=True)
         
         # Copy template workflows to volume (only if they don't already exist)
         if workflows_template.exists():
             print(f"--- Syncing template workflows to volume ---")
-            for workflow_file in workflows_template.glob("*.json"):
-                dest_file = workflows_volume / workflow_file.name
-                if not dest_file.exists():
-                    shutil.copy2(workflow_file, dest_file)
-                    print(f"  Copied: {workflow_file.name}")
+            # One directory listing per side instead of a stat per file
+            with os.scandir(workflows_template) as entries:
+                templates = {e.name for e in entries if e.name.endswith(".json") and e.is_file()}
+            with os.scandir(workflows_volume) as entries:
+                existing = {e.name for e in entries}
+            for name in sorted(templates - existing):
+                fast_copy(workflows_template / name, workflows_volume / name)
+                print(f"  Copied: {name}")
         
         # Copy template comfy.settings.json if it doesn't exist on volume
         settings_template = Path("/root/comfy/ComfyUI/user/default/comfy.settings.json")
         settings_dest = user_default / "comfy.settings.json"
         if settings_template.exists() and not settings_dest.exists():
-            shutil.copy2(settings_template, settings_dest)
+            fast_copy(settings_template, settings_dest)
             print(f"  Copied: comfy.settings.json")
         
         print(f"✅ User data directory ready: {user_data_volume}")
@@ -192,54 +338,76 @@ class ComfyUIContainer:
             print(f"Creating missing custom_nodes directory: {nodes_path}")
             nodes_path.mkdir(parents=True, exist_ok=True)
 
+        # Dependencies were installed at image build; only nodes added or
+        # updated on the volume since then need pip
         print("--- Checking for custom node requirements ---")
-        for node_dir in nodes_path.iterdir():
-            if node_dir.is_dir():
-                req_file = node_dir / "requirements.txt"
-                if req_file.exists():
-                    print(f"Installing requirements for: {node_dir.name}")
-                    # Install dependencies for each node
-                    subprocess.run(
-                        ["pip", "install", "-r", str(req_file)], check=False)
+        manifest_path = Path(DEPS_MANIFEST)
+        manifest = json.loads(manifest_path.read_text()) if manifest_path.exists() else {}
+        install_node_requirements([
+            req_file for req_file in find_node_requirements(nodes_path)
+            if manifest.get(req_file.parent.name) != req_file.stat().st_mtime_ns
+        ])
         print("--- Dependency check complete ---")
 
+    @modal.web_server(WEB_SERVER_PORT, startup_timeout=60)
+    def ui(self):
+        """
+        Launches the ComfyUI web server.
+        """
+        print(f"Starting ComfyUI on  {WEB_SERVER_HOST}:{WEB_SERVER_PORT}...")
+        # Launch through comfy-cli, not ComfyUI's main.py: it adds the
+        # ComfyUI-Manager flags (--enable-manager) and restarts ComfyUI after a
+        # Manager reboot. An argv list avoids the /bin/sh fork and word
+        # splitting of the paths.
+        subprocess.Popen([
+            sys.executable, "-m", "comfy_cli", "launch", "--",
+            "--output-directory", CUSTOM_OUTPUT_DIR,
+            "--user-directory", USER_DATA_DIR,
+            "--listen", WEB_SERVER_HOST,
+            "--port", str(WEB_SERVER_PORT),
+        ])
+
+
+# Downloads are pure network I/O: run them on a CPU-only container so a GPU
+# isn't billed while multi-GB models stream onto the shared volume
+@app.cls(
+    volumes={VOLUME_MOUNT_LOCATION: model_volume},
+    cpu=8.0,
+    memory=8192,
+    timeout=TIMEOUT,
+)
+# I/O-bound inputs multiplex well, so allow far more than the GPU class's
+# MAX_INPUTS; target_inputs leaves headroom before Modal scales out
+@modal.concurrent(max_inputs=64, target_inputs=32)
+class ModelDownloader:
     @modal.method()
-    def download_model(self, repo_id: str, local_dir: str, patterns: list = None):
+    def download_model(self, repo_id: str, local_dir: str = None, patterns: list = None):
         """
         Download a model from HuggingFace to the persistent volume.
         
         Args:
             repo_id: HuggingFace repo ID (e.g., "black-forest-labs/FLUX.2-klein-9B")
-            local_dir: Directory inside volume to save to (e.g., "/root/per_comfy-storage/diffusion_models/FLUX.2-klein-9B")
+            local_dir: Directory inside volume to save to (e.g., "/root/per_comfy-storage/diffusion_models/FLUX.2-klein-9B").
+                       If omitted, the files stay in the HF cache on the volume and its path is returned.
             patterns: Optional list of file patterns to download (e.g., ["*.safetensors"])
         """
-        from huggingface_hub import snapshot_download
-        
-        print(f"📥 Downloading {repo_id} to {local_dir}...")
-        
-        download_kwargs = {
-            "repo_id": repo_id,
-            "local_dir": local_dir,
-            "token": HF_TOKEN,
-            "resume_download": True,
-        }
-        
-        if patterns:
-            download_kwargs["allow_patterns"] = patterns
-        
-        try:
-            snapshot_download(**download_kwargs)
-            print(f"✅ Successfully downloaded {repo_id}")
-        except Exception as e:
-            print(f"❌ Error downloading {repo_id}: {e}")
+        path = download_hf_model(repo_id, local_dir, patterns)
+        # Persist the files so ComfyUI containers see them
+        model_volume.commit()
+        return path
 
-    @modal.web_server(WEB_SERVER_PORT, startup_timeout=60)
-    def ui(self):
+    @modal.method()
+    async def download_models_batch(self, specs: list):
         """
-        Launches the ComfyUI web server.
+        Download several models concurrently in this container.
+
+        Args:
+            specs: List of dicts with download_model's arguments
+                   (repo_id and optional local_dir/patterns)
         """
-        print(f"Starting ComfyUI on  {WEB_SERVER_HOST}:{WEB_SERVER_PORT}...")
-        subprocess.Popen(
-            f"comfy launch -- --output-directory {CUSTOM_OUTPUT_DIR} --user-directory {USER_DATA_DIR} --listen {WEB_SERVER_HOST} --port {WEB_SERVER_PORT}",
-            shell=True
-        )
+        import asyncio
+
+        # Downloads are network-bound, so threads overlap them well
+        paths = await asyncio.gather(*[asyncio.to_thread(download_hf_model, **spec) for spec in specs])
+        await model_volume.commit.aio()
+        return paths
@@ -0,0 +1,66 @@
+"""
+Custom node dependency installation, shared by the image build step and
+container startup in main.py.
+
+Kept free of config.ini so the build step can import it without baking the
+config into the image: the paths it needs are passed in as arguments.
+"""
+
+import json
+import subprocess
+from pathlib import Path
+
+
+def find_node_requirements(nodes_path: Path) -> list:
+    """Returns the requirements.txt of every custom node under nodes_path."""
+    req_files = []
+    for node_dir in nodes_path.iterdir():
+        if node_dir.is_dir():
+            req_file = node_dir / "requirements.txt"
+            if req_file.exists():
+                req_files.append(req_file)
+    return req_files
+
+
+def install_node_requirements(req_files: list) -> list:
+    """
+    Installs all requirement files in a single uv pip run.
+    Returns the requirement files that failed to install.
+    """
+    if not req_files:
+        return []
+    for req_file in req_files:
+        print(f"Installing requirements for: {req_file.parent.name}")
+    # One uv run for all nodes: shared dependencies are resolved and
+    # downloaded once, in parallel, instead of a pip process per node
+    pip_args = [arg for req in req_files for arg in ("-r", str(req))]
+    result = subprocess.run(["uv", "pip", "install", "--system", *pip_args], check=False)
+    if result.returncode == 0:
+        return []
+
+    # A single conflicting or unresolvable requirement fails the combined
+    # resolve; retry per node so the others still get their dependencies
+    print(f"⚠️  Combined install failed (exit {result.returncode}), retrying per node")
+    failed = []
+    for req_file in req_files:
+        result = subprocess.run(
+            ["uv", "pip", "install", "--system", "-r", str(req_file)], check=False)
+        if result.returncode != 0:
+            print(f"❌ Failed to install requirements for {req_file.parent.name} "
+                  f"(exit {result.returncode})")
+            failed.append(req_file)
+    return failed
+
+
+def install_custom_node_deps(nodes_dir: str, manifest_path: str):
+    """
+    Image build step: installs dependencies of the custom nodes on the volume
+    so containers don't pay for pip on every cold start, and records them in
+    the manifest at manifest_path.
+    """
+    nodes_path = Path(nodes_dir)
+    req_files = find_node_requirements(nodes_path) if nodes_path.exists() else []
+    failed = install_node_requirements(req_files)
+    # Leave failed nodes out so container start retries them
+    manifest = {req.parent.name: req.stat().st_mtime_ns for req in req_files if req not in failed}
+    Path(manifest_path).write_text(json.dumps(manifest))